@@ -63,7 +63,7 @@ class CustomedEqs():
         self.NSample = self.Samples.shape[1]
         
         # svd decomposition
-        self.Modes, self.sigma, _ = np.linalg.svd(self.Samples);
+        self.Modes, self.sigma, _ = np.linalg.svd(self.Samples, full_matrices=False);
         self.Modes = self.Modes[:,:M]
         self.M = M
         
@@ -116,7 +116,7 @@ class CustomedEqs():
             source = self.getsource(alpha1i, alpha2i).T
             dis = alpha[i:i+1,:] - self.parameters
             dis = np.linalg.norm(dis, axis=1);
-            ind = np.where(dis == dis.min())[0][0]
+            ind = np.argmin(dis)
             lamda0 = self.projections[0:self.M, ind:ind+1]
             #Newton iteration
             it = 0; err =1;
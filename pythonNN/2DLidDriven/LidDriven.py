@@ -45,16 +45,17 @@ sys.path.insert(0,'../tools/NNs')
 
 from Chebyshev import Chebyshev2D
 from scipy.io import loadmat
+from scipy.linalg import svd
 import numpy as np
 import torch
 from NN import POD_Net, DEVICE
 from Normalization import Normalization
-from scipy.optimize import fsolve
 
 # Eqs parameters
-NVAR = 3     # the number of unknown variables: p,u,v
+NVAR = 3    # the number of unknown variables: p,u,v
 NVARLOAD = 6 # the number of loaded variables: p,u,v,t(dummy),omega,psi
 Newton = {'iterMax':100, 'eps':1E-6}
+DEG2RAD = 3.14159265359/180
 
 # reproducible
 torch.manual_seed(1234)  
@@ -66,31 +67,43 @@ class CustomedEqs():
         datas = loadmat(matfilePOD)
         # data for POD
         #PODNum=3
-        self.Samples      = datas['Samples'][:,0:PODNum]
         self.FieldShape   = tuple(datas['FieldShape'][0])
         self.parameters   = datas['parameters'][0:PODNum,:]
         self.design_space = datas['design_space']
-        self.NSample = self.Samples.shape[1]
-        
+        # structure-of-arrays layout: one contiguous (Nx,Ny,NSample) block
+        # per variable instead of the interleaved per-point records on disk
+        Nx, Ny = self.FieldShape
+        self.Samples = datas['Samples'][:,0:PODNum].reshape(Nx,Ny,NVARLOAD,-1).transpose(2,0,1,3).copy()
+        self.NSample = self.Samples.shape[3]
+        # flat indices of the interior p,u,v entries within a loaded snapshot
+        self._interior_idx = np.arange(Nx*Ny*NVARLOAD).reshape(Nx,Ny,NVARLOAD)[1:-1,1:-1,0:NVAR].ravel()
+        # interior snapshot matrix in the original (x,y,var) flat ordering
+        SnapMat = np.transpose(self.Samples[0:NVAR,1:-1,1:-1,:], (1,2,0,3)).reshape(-1, self.NSample)
+
         # data for validation
         datas = loadmat(matfileValidation)
         self.ValidationParameters   = datas['parameters']
         self.ValidationSamples      = self.ExtractInteriorSnapshots( datas['Samples'] )
-    
-        
-        # svd decomposition
-        self.Modes, self.sigma, _ = np.linalg.svd( self.ExtractInteriorSnapshots(self.Samples) );
+
+
+        # svd decomposition: hand LAPACK gesdd an F-ordered copy it may
+        # overwrite, skipping the extra copies and finiteness check
+        X = np.asfortranarray( SnapMat )
+        self.Modes, self.sigma, _ = svd( X, full_matrices=False, overwrite_a=True, check_finite=False, lapack_driver='gesdd')
         self.Modes = self.Modes[:,:M]
         self.M = M
         
         # spatial discretization
         self.Chby2D   = Chebyshev2D(xL=-1, xR=1, yD=-1, yU=1, Mx=self.FieldShape[0]-1,My=self.FieldShape[1]-1)
         self.dxp,self.dyp  = self.Chby2D.DxCoeffN2()
-        self.dx, self.dy   = self.Chby2D.DxCoeff(1) 
+        self.dx, self.dy   = self.Chby2D.DxCoeff(1)
         self.d2x, self.d2y = self.Chby2D.DxCoeff(2)
+        # contiguous transposes so the y-derivatives run as phi @ dy.T
+        self.dyT  = np.ascontiguousarray(self.dy.T)
+        self.dypT = np.ascontiguousarray(self.dyp.T)
 
         # projections
-        self.projections = np.matmul( self.Modes.T, self.ExtractInteriorSnapshots(self.Samples))
+        self.projections = np.matmul( self.Modes.T, SnapMat)
         _, Mapping  = Normalization.Mapstatic(self.projections.T)
         self.proj_mean =  Mapping[0][None,:] 
         self.proj_std  =  Mapping[1][None,:] 
@@ -100,8 +113,9 @@ class CustomedEqs():
         self.Interior = np.zeros(self.FieldShape)
         self.Interior[1:-1,1:-1]=1
         self.Boundary=1-self.Interior
-        self.uBC = np.reshape(self.Samples[1::NVARLOAD,0], self.FieldShape)*self.Boundary
+        self.uBC = self.Samples[1,:,:,0]*self.Boundary
         self.InteriorShape = (self.FieldShape[0]-2, self.FieldShape[1]-2,)
+        self._precompute_mode_fields()
         self.Beqs, self.Bbc = self.getB()
         self.Aeqs, self.Abc = self.getA()
         
@@ -110,24 +124,33 @@ class CustomedEqs():
         self.ProjError = self.GetError(self.lamda_proj)
         
     def Mode2Field(self, Vec):
-        p,u,v = np.zeros(self.FieldShape), np.zeros(self.FieldShape), np.zeros(self.FieldShape)
+        # the interior is overwritten, so only the boundary ring is zeroed
+        p,u,v = fields = np.empty((NVAR,)+self.FieldShape)
+        fields[:,[0,-1],:] = 0
+        fields[:,:,[0,-1]] = 0
         p[1:-1,1:-1] = np.reshape( Vec[0::NVAR], self.InteriorShape)
         u[1:-1,1:-1] = np.reshape( Vec[1::NVAR], self.InteriorShape)
         v[1:-1,1:-1] = np.reshape( Vec[2::NVAR], self.InteriorShape)
         return p,u,v
+    def Mode2FieldStack(self, Modes):
+        # padded fields of several modes at once, each of shape (M, Nx, Ny)
+        M = Modes.shape[1]
+        p,u,v = np.zeros((3,M,)+self.FieldShape)
+        p[:,1:-1,1:-1] = np.reshape( Modes[0::NVAR,:].T, (M,)+self.InteriorShape)
+        u[:,1:-1,1:-1] = np.reshape( Modes[1::NVAR,:].T, (M,)+self.InteriorShape)
+        v[:,1:-1,1:-1] = np.reshape( Modes[2::NVAR,:].T, (M,)+self.InteriorShape)
+        return p,u,v
     def ExtractInteriorSnapshots(self,Samples):
-        NSample = Samples.shape[1]
-        Samples_shape = (self.FieldShape[0], self.FieldShape[1],NVARLOAD,NSample,)
-        return np.reshape( np.reshape(Samples, Samples_shape)[1:-1, 1:-1, 0:NVAR, :], (-1, NSample))
+        return Samples[self._interior_idx, :]
     
     def Compute_d_dxc(self, phi):
         return np.matmul(self.dx,phi)
     def Compute_d_dyc(self, phi):
-        return np.matmul(self.dy, phi.T).T
+        return np.matmul(phi, self.dyT)
     def Compute_dp_dxc(self, phi):
         return np.matmul(self.dxp,phi)
     def Compute_dp_dyc(self, phi):
-        return np.matmul(self.dyp, phi.T).T    
+        return np.matmul(phi, self.dypT)
     def Compute_d_dxc2(self, phi):
         return self.Compute_d_dxc( self.Compute_d_dxc(phi) )
     def Compute_d_dyc2(self, phi):
@@ -140,7 +163,17 @@ class CustomedEqs():
         return self.Compute_dp_dxc(phi), self.Compute_dp_dyc(phi)
     def Compute_d_d2(self, phi):
         return self.Compute_d_dxc2(phi), self.Compute_d_dyc2(phi), self.Compute_d_dxcyc(phi)
-        
+
+    def _precompute_mode_fields(self):
+        # cache the padded mode fields and their Chebyshev derivatives once
+        # as (M, Nx, Ny) stacks shared by getA and getB
+        self.P, self.U, self.V = self.Mode2FieldStack(self.Modes)
+        self.Uxc, self.Uyc = np.matmul(self.dx, self.U), np.matmul(self.U, self.dyT)
+        self.Vxc, self.Vyc = np.matmul(self.dx, self.V), np.matmul(self.V, self.dyT)
+        self.Pxc, self.Pyc = np.matmul(self.dxp,self.P), np.matmul(self.P, self.dypT)
+        self.Uxc2, self.Uyc2, self.Uxcyc = np.matmul(self.dx, self.Uxc), np.matmul(self.Uyc, self.dyT), np.matmul(self.Uxc, self.dyT)
+        self.Vxc2, self.Vyc2, self.Vxcyc = np.matmul(self.dx, self.Vxc), np.matmul(self.Vyc, self.dyT), np.matmul(self.Vxc, self.dyT)
+
     # get A from the first mth modes
     def getA(self): 
         """0:3 namely first index is related to terms:
@@ -152,22 +185,26 @@ class CustomedEqs():
         Aeqs = np.zeros((4, self.M, self.M, self.M))
         Abc  = np.zeros((4, self.M, self.M))
         uBCxc, uBCyc= self.Compute_d_d1(self.uBC)
-        for j in range(self.M):
-            pj, uj, vj= self.Mode2Field(self.Modes[:,j])
-            ujxc, ujyc= self.Compute_d_d1(uj)      
-            vjxc, vjyc= self.Compute_d_d1(vj)  
-            for k in range(self.M):
-                pk, uk,vk = self.Mode2Field(self.Modes[:,k])
-                for i in range(self.M):
-                    pi, ui,vi = self.Mode2Field(self.Modes[:,i])
-                    Aeqs[0,k,i,j] = ( self.Interior*(ui*ujxc*uk + ui*vjxc*vk) ).sum()
-                    Aeqs[1,k,i,j] = ( self.Interior*(ui*ujyc*uk + ui*vjyc*vk) ).sum()
-                    Aeqs[2,k,i,j] = ( self.Interior*(vi*ujxc*uk + vi*vjxc*vk) ).sum()
-                    Aeqs[3,k,i,j] = ( self.Interior*(vi*ujyc*uk + vi*vjyc*vk) ).sum()
-                    Abc[0,k,i]  = ( self.Interior*(ui*uBCxc*uk              ) ).sum()
-                    Abc[1,k,i]  = ( self.Interior*(ui*uBCyc*uk              ) ).sum()
-                    Abc[2,k,i]  = ( self.Interior*(vi*uBCxc*uk              ) ).sum()
-                    Abc[3,k,i]  = ( self.Interior*(vi*uBCyc*uk              ) ).sum()
+        # interior-only views of the cached stacks: the 0/1 mask reduces to a
+        # slice because the undifferentiated mode fields vanish on the boundary
+        crop = np.s_[:,1:-1,1:-1]
+        U,   V   = self.U[crop],   self.V[crop]
+        Uxc, Uyc = self.Uxc[crop], self.Uyc[crop]
+        Vxc, Vyc = self.Vxc[crop], self.Vyc[crop]
+        uBCxc, uBCyc = uBCxc[1:-1,1:-1], uBCyc[1:-1,1:-1]
+        # contract the triple products over the interior points in one shot
+        Aeqs[0] = np.einsum('ixy,jxy,kxy->kij', U, Uxc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', U, Vxc, V, optimize=True)
+        Aeqs[1] = np.einsum('ixy,jxy,kxy->kij', U, Uyc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', U, Vyc, V, optimize=True)
+        Aeqs[2] = np.einsum('ixy,jxy,kxy->kij', V, Uxc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', V, Vxc, V, optimize=True)
+        Aeqs[3] = np.einsum('ixy,jxy,kxy->kij', V, Uyc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', V, Vyc, V, optimize=True)
+        Abc[0]  = np.einsum('ixy,xy,kxy->ki', U, uBCxc, U, optimize=True)
+        Abc[1]  = np.einsum('ixy,xy,kxy->ki', U, uBCyc, U, optimize=True)
+        Abc[2]  = np.einsum('ixy,xy,kxy->ki', V, uBCxc, U, optimize=True)
+        Abc[3]  = np.einsum('ixy,xy,kxy->ki', V, uBCyc, U, optimize=True)
         return Aeqs,Abc
         
     def getB(self):
@@ -182,44 +219,46 @@ class CustomedEqs():
         Bbc  = np.zeros((7,self.M))
         
         uBCxc, uBCyc= self.Compute_d_d1(self.uBC)
-        uBCxc2, uBCyc2, uBCxcyc = self.Compute_d_d2(self.uBC)       
-        for j in range(self.M):
-            pj, uj, vj= self.Mode2Field(self.Modes[:,j])      
-            ujxc, ujyc= self.Compute_d_d1(uj)
-            vjxc, vjyc= self.Compute_d_d1(vj)
-            pjxc, pjyc= self.Compute_d_d1p(pj)
-            ujxc2, ujyc2, ujxcyc = self.Compute_d_d2(uj)
-            vjxc2, vjyc2, vjxcyc = self.Compute_d_d2(vj)
-            for i in range(self.M):
-                pi, ui,vi = self.Mode2Field(self.Modes[:,i])
-                Beqs[0,i,j] = ( self.Interior*(  ujxc*pi + pjxc*ui ) ).sum()
-                Beqs[1,i,j] = ( self.Interior*(  ujyc*pi + pjyc*ui ) ).sum()
-                Beqs[2,i,j] = ( self.Interior*(  vjxc*pi + pjxc*vi ) ).sum()
-                Beqs[3,i,j] = ( self.Interior*(  vjyc*pi + pjyc*vi ) ).sum()
-                Beqs[4,i,j] =-( self.Interior*( ujxc2*ui + vjxc2*vi) ).sum()
-                Beqs[5,i,j] =-( self.Interior*( ujyc2*ui + vjyc2*vi) ).sum()
-                Beqs[6,i,j] =-( self.Interior*(ujxcyc*ui +vjxcyc*vi) ).sum()
+        uBCxc2, uBCyc2, uBCxcyc = self.Compute_d_d2(self.uBC)
+        # interior-only views of the cached stacks: the 0/1 mask reduces to a
+        # slice because the undifferentiated mode fields vanish on the boundary
+        crop = np.s_[:,1:-1,1:-1]
+        P,    U,    V     = self.P[crop],    self.U[crop],    self.V[crop]
+        Uxc,  Uyc         = self.Uxc[crop],  self.Uyc[crop]
+        Vxc,  Vyc         = self.Vxc[crop],  self.Vyc[crop]
+        Pxc,  Pyc         = self.Pxc[crop],  self.Pyc[crop]
+        Uxc2, Uyc2, Uxcyc = self.Uxc2[crop], self.Uyc2[crop], self.Uxcyc[crop]
+        Vxc2, Vyc2, Vxcyc = self.Vxc2[crop], self.Vyc2[crop], self.Vxcyc[crop]
+        uBCxc,  uBCyc          = uBCxc[1:-1,1:-1],  uBCyc[1:-1,1:-1]
+        uBCxc2, uBCyc2, uBCxcyc= uBCxc2[1:-1,1:-1], uBCyc2[1:-1,1:-1], uBCxcyc[1:-1,1:-1]
+        # contract the double products over the interior points in one shot
+        Beqs[0] = np.einsum('ixy,jxy->ij', P, Uxc) + np.einsum('ixy,jxy->ij', U, Pxc)
+        Beqs[1] = np.einsum('ixy,jxy->ij', P, Uyc) + np.einsum('ixy,jxy->ij', U, Pyc)
+        Beqs[2] = np.einsum('ixy,jxy->ij', P, Vxc) + np.einsum('ixy,jxy->ij', V, Pxc)
+        Beqs[3] = np.einsum('ixy,jxy->ij', P, Vyc) + np.einsum('ixy,jxy->ij', V, Pyc)
+        Beqs[4] =-np.einsum('ixy,jxy->ij', U, Uxc2) - np.einsum('ixy,jxy->ij', V, Vxc2)
+        Beqs[5] =-np.einsum('ixy,jxy->ij', U, Uyc2) - np.einsum('ixy,jxy->ij', V, Vyc2)
+        Beqs[6] =-np.einsum('ixy,jxy->ij', U, Uxcyc) - np.einsum('ixy,jxy->ij', V, Vxcyc)
 
-                Bbc[0,i] = ( self.Interior*( uBCxc*pi              ) ).sum()
-                Bbc[1,i] = ( self.Interior*( uBCyc*pi              ) ).sum()
-                Bbc[2,i] = ( self.Interior*( 0*pi                  ) ).sum()
-                Bbc[3,i] = ( self.Interior*( 0*pi                  ) ).sum()
-                Bbc[4,i] =-( self.Interior*( uBCxc2*ui             ) ).sum()
-                Bbc[5,i] =-( self.Interior*( uBCyc2*ui             ) ).sum()
-                Bbc[6,i] =-( self.Interior*(uBCxcyc*ui             ) ).sum()                
+        Bbc[0] = np.einsum('xy,ixy->i', uBCxc,  P)
+        Bbc[1] = np.einsum('xy,ixy->i', uBCyc,  P)
+        Bbc[4] =-np.einsum('xy,ixy->i', uBCxc2, U)
+        Bbc[5] =-np.einsum('xy,ixy->i', uBCyc2, U)
+        Bbc[6] =-np.einsum('xy,ixy->i', uBCxcyc,U)
         return Beqs,Bbc
     def getJac(self,alpha, cos=np.cos, sin=np.sin, cat=np.concatenate):
-        Theta = alpha[:,1:2]/180*3.14159265359        
+        Theta = alpha[:,1:2]*DEG2RAD
+        sinTh, cosTh = sin(Theta), cos(Theta)
         xCoef, yCoef = 1/2, 1/2
         Jac11=1/xCoef*(Theta*0+1)
         Jac12=0.0*Theta
-        Jac21=-cos(Theta)/sin(Theta)/xCoef
-        Jac22= 1/yCoef/sin(Theta)
+        Jac21=-cosTh/sinTh/xCoef
+        Jac22= 1/yCoef/sinTh
         return Jac11,Jac12,Jac21,Jac22
     def getGrid(self,alpha,cos=np.cos, sin=np.sin, cat=np.concatenate):
         xc,yc = self.Chby2D.grid()
         xCoef, yCoef = 1/2, 1/2
-        Theta = alpha[:,1:2]/180*3.14159265359 
+        Theta = alpha[:,1:2]*DEG2RAD
         xp = xc*xCoef + yc*yCoef*cos(Theta)
         yp = yc*yCoef*sin(Theta)
         return xp,yp
@@ -230,42 +269,89 @@ class CustomedEqs():
         BCoef = cat((Jac11, Jac12, Jac21, Jac22, v*(Jac11**2+Jac21**2), v*(Jac12**2+Jac22**2), 2*v*(Jac11*Jac12+Jac21*Jac22)), axis=1)
         return Acoef, BCoef
     
-    def POD_Gfsolve(self,alpha, lamda_init=None):
+    def POD_Gfsolve(self,alpha, lamda_init=None, device=None):
         n = alpha.shape[0]
-        lamda  = np.zeros((n, self.M))
-        def compute_eAe(A, e):
-            tmp  = np.matmul(e.T, A)
-            return np.matmul(tmp, e).squeeze(axis=(2))
-        def eqs(x,A,B,source):
-            lamda = x[:,None];
-            lamda = lamda*self.proj_std.T + self.proj_mean.T
-            err = compute_eAe(A,lamda) + np.matmul(B,lamda) -source
-            return err.squeeze()
+        # assemble the reduced systems of all cases at once
+        ACoeff, BCoeff = self.getABCoef(alpha[:,0:2])
+        A      = np.einsum('nc,cijk->nijk', ACoeff, self.Aeqs)
+        B      = np.einsum('nc,cij->nij',   ACoeff, self.Abc)\
+                +np.einsum('nc,cij->nij',   BCoeff, self.Beqs)
+        source =-np.einsum('nc,ci->ni',     BCoeff, self.Bbc)
+
+        if lamda_init is None:
+            # initialize from the projections of the nearest sample points
+            dis = (alpha[:,None,0:2] - self.parameters[None,:,:])\
+                 /(self.design_space[1:2,:]-self.design_space[0:1,:] )
+            ind = np.argmin( np.linalg.norm(dis, axis=2), axis=1)
+            lamda = self.projections[0:self.M, ind].T.copy()
+        else:
+            lamda = lamda_init.copy()
+        if device is not None:
+            # offload the batched Newton to a torch device: the stacked
+            # systems are factorized with one batched LU per step
+            lamda = self._GNewton_torch(A, B, source, lamda, device)
+        else:
+            lamda = self._GNewton_numpy(A, B, source, lamda)
+        err = np.linalg.norm( np.einsum('ni,nkij,nj->nk', lamda, A, lamda)\
+                             +np.einsum('nkj,nj->nk', B, lamda) - source, axis=1)
         for i in range(n):
-            alphai = alpha[i:i+1,0:2]
-            AiCoeff, BiCoeff = self.getABCoef(alphai)
-            AiCoeff, BiCoeff = AiCoeff.squeeze(axis=0), BiCoeff.squeeze(axis=0)
-            Ai = ( AiCoeff[:,None,None,None]* self.Aeqs ).sum(axis=0)
-            Bi = ( AiCoeff[:,None,None]* self.Abc  ).sum(axis=0) \
-                +( BiCoeff[:,None,None]* self.Beqs ).sum(axis=0)
-            sourcei = -( BiCoeff[:,None]* self.Bbc  ).sum(axis=0)[:,None]
-            
-            if lamda_init is None:
-                dis = (alphai - self.parameters)/ (self.design_space[1:2,:]-self.design_space[0:1,:] )
-                dis = np.linalg.norm(dis, axis=1);
-                ind = np.where(dis == dis.min())[0][0]
-                lamda0 = self.projections[0:self.M, ind:ind+1].T
-            else:
-                lamda0 = lamda_init[i:i+1,:]   
-            lamda0 = (lamda0-self.proj_mean)/self.proj_std
-            lamdasol = fsolve(lambda x: eqs(x,Ai,Bi,sourcei), lamda0.squeeze())
-            err = np.linalg.norm( eqs(lamdasol, Ai, Bi, sourcei) )
-            if err > Newton["eps"]:
-                print('Case %d: (%f,%f) can only reach to an error of %f'%(i, alphai[0,0], alphai[0,1], err))
-                #lamdasol = lamdasol*0 + np.inf
-            lamda[i,:] = lamdasol[None,:]*self.proj_std + self.proj_mean
-            
+            if err[i] > Newton['eps']:
+                print('Case %d: (%f,%f) can only reach to an error of %f'%(i, alpha[i,0], alpha[i,1], err[i]))
         return lamda
+
+    def _GNewton_numpy(self, A, B, source, lamda):
+        n = lamda.shape[0]
+        # Newton iteration on all cases simultaneously with the analytic
+        # Jacobian 2*A*lamda + B
+        def residual(lamda):
+            return np.einsum('ni,nkij,nj->nk', lamda, A, lamda)\
+                  +np.einsum('nkj,nj->nk', B, lamda) - source
+        for it in range(Newton['iterMax']):
+            res = residual(lamda)
+            err = np.linalg.norm(res, axis=1)
+            if err.max() < Newton['eps']:
+                break
+            Jac = np.einsum('nkij,nj->nki', A, lamda)\
+                 +np.einsum('nkij,ni->nkj', A, lamda) + B
+            step = np.linalg.solve(Jac, res[:,:,None])[:,:,0]
+            # damp the step per case until its residual stops increasing
+            t = np.ones((n,1))
+            for k in range(10):
+                newerr = np.linalg.norm( residual(lamda - t*step), axis=1)
+                decrease = newerr <= err
+                if decrease.all():
+                    break
+                t[~decrease] *= 0.5
+            lamda = lamda - t*step
+        return lamda
+
+    def _GNewton_torch(self, A, B, source, lamda, device):
+        n = lamda.shape[0]
+        A      = torch.tensor(A     ).to(device)
+        B      = torch.tensor(B     ).to(device)
+        source = torch.tensor(source).to(device)
+        lamda  = torch.tensor(lamda ).to(device)
+        def residual(lamda):
+            return torch.einsum('ni,nkij,nj->nk', lamda, A, lamda)\
+                  +torch.einsum('nkj,nj->nk', B, lamda) - source
+        for it in range(Newton['iterMax']):
+            res = residual(lamda)
+            err = torch.linalg.norm(res, dim=1)
+            if err.max() < Newton['eps']:
+                break
+            Jac = torch.einsum('nkij,nj->nki', A, lamda)\
+                 +torch.einsum('nkij,ni->nkj', A, lamda) + B
+            step = torch.linalg.solve(Jac, res[:,:,None])[:,:,0]
+            # damp the step per case until its residual stops increasing
+            t = torch.ones((n,1), dtype=lamda.dtype, device=lamda.device)
+            for k in range(10):
+                newerr = torch.linalg.norm( residual(lamda - t*step), dim=1)
+                decrease = newerr <= err
+                if decrease.all():
+                    break
+                t[~decrease] *= 0.5
+            lamda = lamda - t*step
+        return lamda.cpu().numpy()
     
     
     def GetError(self,lamda):
@@ -274,10 +360,10 @@ class CustomedEqs():
             raise Exception('The number of lamda should be equal to validation parameters')
         phi_pred         = np.matmul( lamda, self.Modes.T)
         phi_Num          = self.ValidationSamples.T
-        Error = np.zeros((Nvalidation,NVAR))    # the second dimension is [p,u,v]
-        for nvar in range(NVAR):
-            Error[:,nvar] = np.linalg.norm(phi_Num[:,nvar::NVAR]-phi_pred[:,nvar::NVAR], axis = 1)\
-                           /np.linalg.norm(phi_Num[:,nvar::NVAR], axis=1)
+        # snapshots are point-major with the variables on the innermost
+        # axis, so one reshape separates [p,u,v] for all cases at once
+        Error = np.linalg.norm((phi_Num-phi_pred).reshape(Nvalidation,-1,NVAR), axis=1)\
+               /np.linalg.norm(  phi_Num          .reshape(Nvalidation,-1,NVAR), axis=1)
         Errorpuv = Error.mean(axis=0)
         Errortotal =  np.linalg.norm(phi_Num[:,:]-phi_pred[:,:], axis = 1)\
                                    /np.linalg.norm(phi_Num[:,:], axis=1)
@@ -286,6 +372,25 @@ class CustomedEqs():
         print("Errors=[%f,%f,%f],%f"%(Errorpuv[0],Errorpuv[1],Errorpuv[2], Errortotal))
         return Errorpuv, Errortotal
         
+    def SolvePsiPoisson(self, omega, cxx, cyy, cxy):
+        # direct solve of cxx*psi_xc2 + cyy*psi_yc2 + cxy*psi_xcyc = omega
+        # on the interior points with psi=0 on the boundary; the inverted
+        # operator only depends on the metric coefficients and is cached
+        # across cases
+        if not hasattr(self, '_psiLinv'):
+            self._psiLinv = {}
+        key = (cxx, cyy, cxy)
+        if key not in self._psiLinv:
+            Nx,Ny = self.FieldShape
+            L = cxx*np.kron(np.matmul(self.dx,self.dx), np.eye(Ny))\
+               +cyy*np.kron(np.eye(Nx), np.matmul(self.dy,self.dy))\
+               +cxy*np.kron(self.dx, self.dy)
+            interior = self.Interior.ravel() > 0
+            self._psiLinv[key] = np.linalg.inv( L[np.ix_(interior,interior)] )
+        psi = np.zeros(self.FieldShape)
+        psi[1:-1,1:-1] = np.matmul( self._psiLinv[key], omega[1:-1,1:-1].ravel() ).reshape(self.InteriorShape)
+        return psi
+
     def GetPredFields(self,alpha,lamda, filename):
         Ncase = lamda.shape[0]
         Fields = []
@@ -300,27 +405,15 @@ class CustomedEqs():
             ui_xc, ui_yc= self.Compute_d_d1(ui)
             vi_xc, vi_yc= self.Compute_d_d1(vi)
             xp,yp = self.getGrid(alphai)
-            hx = abs(xp[0,0]-xp[1,0])
-            hy = abs(yp[0,0]-yp[0,1])
             omegai =  ui_xc*J21[icase]+ui_yc*J22[icase] -vi_xc*J11[icase]-vi_yc*J12[icase]
-            ## solve psi with explicit method
+            ## solve psi with a direct solve on the interior points
             # psi_xp2 + psi_yp2 = psi_xc2*(J11^2+J21^2)+psi_yc2*(J12^2+J22^2)+psi_xcyc*(2*J11*J12+2*J21*J22)
             #                   = omega
-            dt = 0.5*min(hx,hy)**2
-            psii = 0*omegai
-            for it in range(int(1E8)):
-                psi_xc2,psi_yc2, psi_xcyc = self.Compute_d_d2(psii) 
-                dpsi = psi_xc2*(J11[icase]**2+J21[icase]**2)\
-                      +psi_yc2*(J12[icase]**2+J22[icase]**2)\
-                      +psi_xcyc*(2*J11[icase]*J12[icase]+2*J21[icase]*J22[icase])\
-                      -omegai
-                dpsi = dpsi * self.Interior
-                psii = psii +dpsi*dt
-                if it%10000==0:
-                    print('%8d, dpsi=%e'%(it, np.abs(dpsi).max()))
-                if np.abs(dpsi).max() < 1E-8:
-                    break
-            
+            cxx = float(J11[icase,0]**2+J21[icase,0]**2)
+            cyy = float(J12[icase,0]**2+J22[icase,0]**2)
+            cxy = float(2*J11[icase,0]*J12[icase,0]+2*J21[icase,0]*J22[icase,0])
+            psii = self.SolvePsiPoisson(omegai, cxx, cyy, cxy)
+
             # write result
             Nx,Ny = self.FieldShape
             with open(filename+'%d'%icase+'.plt','w') as f:
@@ -329,10 +422,9 @@ title="result"
 variables="x","y","P","u","v","omega","psi"
 zone,j=%d, i=%d,f=point"""%(Ny,Nx) + "\n"
                 f.write(header)
-                for j in range(Ny):
-                    for i in range(Nx):
-                        line=("%21.16f\t"*7 + "\n" )%(xp[i,j],yp[i,j],pi[i,j],ui[i,j],vi[i,j],omegai[i,j],psii[i,j])
-                        f.write(line)
+                # i runs fastest in f=point ordering, hence the transposes
+                arr = np.column_stack([phi.T.ravel() for phi in (xp,yp,pi,ui,vi,omegai,psii)])
+                np.savetxt(f, arr, fmt='%21.16f', delimiter='\t')
             
             Fields.append( np.stack((xp, yp, pi, ui, vi, omegai, psii), axis=0) )
         Fields = np.stack( tuple(Fields), axis=0)
@@ -354,7 +446,7 @@ class CustomedNet(POD_Net):
         self.proj_std = torch.tensor( roeqs.proj_std ).float().to(DEVICE)
         self.proj_mean= torch.tensor( roeqs.proj_mean).float().to(DEVICE)
         self.roeqs = roeqs
-        
+
         self.labeled_inputs  = torch.tensor( roeqs.parameters ).float().to(DEVICE)
         self.labeled_outputs = torch.tensor( roeqs.projections.T ).float().to(DEVICE)
         self.labeledLoss = self.loss_Eqs(self.labeled_inputs,self.labeled_outputs)
@@ -380,13 +472,12 @@ class CustomedNet(POD_Net):
     def loss_Eqs(self,x,lamda,weight=1):
         #lamda = self.u_net(x);
         ACoeff, BCoeff = self.roeqs.getABCoef(x, cos=torch.cos, sin=torch.sin, cat=torch.cat)
-        A = ( ACoeff[:,:,None,None,None]* self.Aeqs[None,:,:,:,:] ).sum(axis=1)
-        B = ( ACoeff[:,:,None,None]* self.Abc[ None,:,:,:]  ).sum(axis=1) \
-           +( BCoeff[:,:,None,None]* self.Beqs[None,:,:,:]  ).sum(axis=1)
-        source = -( BCoeff[:,:,None]* self.Bbc[None,:,:]  ).sum(axis=1)
-        fx   = torch.matmul(lamda[:,None,None,:], A)
-        fx   = torch.matmul(fx,lamda[:,None,:,None])
-        fx   = fx.view(lamda.shape) + torch.matmul(B,lamda[:,:,None]).view(lamda.shape) -source
+        A = torch.einsum('nc,cijk->nijk', ACoeff, self.Aeqs)
+        B = torch.einsum('nc,cij->nij', ACoeff, self.Abc)\
+           +torch.einsum('nc,cij->nij', BCoeff, self.Beqs)
+        source = -torch.einsum('nc,ci->ni', BCoeff, self.Bbc)
+        fx   = torch.einsum('ni,nkij,nj->nk', lamda, A, lamda)\
+              +torch.einsum('nkj,nj->nk', B, lamda) - source
         return self.lossfun(weight*fx,torch.zeros_like(fx))
     
 
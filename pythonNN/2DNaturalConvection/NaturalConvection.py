@@ -33,6 +33,7 @@ sys.path.insert(0,'../tools/NNs')
 
 from Chebyshev import Chebyshev2D
 from scipy.io import loadmat
+from scipy.linalg import svd
 import numpy as np
 import torch
 from NN import POD_Net, DEVICE
@@ -65,8 +66,10 @@ class CustomedEqs():
         self.ValidationSamples      = self.ExtractInteriorSnapshots( datas['Samples'] )
     
         
-        # svd decomposition
-        self.Modes, self.sigma, _ = np.linalg.svd( self.ExtractInteriorSnapshots(self.Samples) );
+        # svd decomposition: hand LAPACK gesdd an F-ordered copy it may
+        # overwrite, skipping the extra copies and finiteness check
+        X = np.asfortranarray( self.ExtractInteriorSnapshots(self.Samples) )
+        self.Modes, self.sigma, _ = svd( X, full_matrices=False, overwrite_a=True, check_finite=False, lapack_driver='gesdd')
         self.Modes = self.Modes[:,:M]
         self.M = M
         
@@ -74,8 +77,11 @@ class CustomedEqs():
         self.xCoef, self.yCoef = 1/2, 1/2
         self.Chby2D   = Chebyshev2D(xL=-1, xR=1, yD=-1, yU=1, Mx=self.FieldShape[0]-1,My=self.FieldShape[1]-1)
         self.dxp,self.dyp  = self.Chby2D.DxCoeffN2()
-        self.dx, self.dy   = self.Chby2D.DxCoeff(1) 
+        self.dx, self.dy   = self.Chby2D.DxCoeff(1)
         self.d2x, self.d2y = self.Chby2D.DxCoeff(2)
+        # contiguous transposes so the y-derivatives run as phi @ dy.T
+        self.dyT  = np.ascontiguousarray(self.dy.T)
+        self.dypT = np.ascontiguousarray(self.dyp.T)
 
         # projections
         self.projections = np.matmul( self.Modes.T, self.ExtractInteriorSnapshots(self.Samples))
@@ -122,11 +128,11 @@ class CustomedEqs():
     def Compute_d_dxc(self, phi):
         return np.matmul(self.dx,phi)/self.xCoef
     def Compute_d_dyc(self, phi):
-        return np.matmul(self.dy, phi.T).T/self.yCoef
+        return np.matmul(phi, self.dyT)/self.yCoef
     def Compute_dp_dxc(self, phi):
         return np.matmul(self.dxp,phi)/self.xCoef
     def Compute_dp_dyc(self, phi):
-        return np.matmul(self.dyp, phi.T).T/self.yCoef   
+        return np.matmul(phi, self.dypT)/self.yCoef
     def Compute_d_dxc2(self, phi):
         return self.Compute_d_dxc( self.Compute_d_dxc(phi) )
     def Compute_d_dyc2(self, phi):
@@ -139,7 +145,22 @@ class CustomedEqs():
         return self.Compute_dp_dxc(phi), self.Compute_dp_dyc(phi)
     def Compute_d_d2(self, phi):
         return self.Compute_d_dxc2(phi), self.Compute_d_dyc2(phi)
-    
+
+    def SolvePsiPoisson(self, omega):
+        # direct solve of psi_xc2 + psi_yc2 = omega with psi=0 on the
+        # boundary; the grid rotation is orthonormal, so this is the
+        # physical-space Laplacian as well. The operator does not depend
+        # on the case, hence its interior inverse is cached
+        if not hasattr(self, '_psiLinv'):
+            Nx,Ny = self.FieldShape
+            L = np.kron( np.matmul(self.dx,self.dx), np.eye(Ny) )/self.xCoef**2 \
+               +np.kron( np.eye(Nx), np.matmul(self.dy,self.dy) )/self.yCoef**2
+            interior = self.Interior.ravel() > 0
+            self._psiLinv = np.linalg.inv( L[np.ix_(interior,interior)] )
+        psi = np.zeros(self.FieldShape)
+        psi[1:-1,1:-1] = np.matmul( self._psiLinv, omega[1:-1,1:-1].ravel() ).reshape(self.InteriorShape)
+        return psi
+
     # get A from the first mth modes
     def getA(self): 
         """0:3 namely first index is related to terms:
@@ -151,19 +172,24 @@ class CustomedEqs():
         Aeqs = np.zeros((1,self.M, self.M, self.M))
         Abc  = np.zeros((1,self.M, self.M))
         TBCxc, TBCyc= self.Compute_d_d1(self.TBC)
-        for j in range(self.M):
-            pj, uj, vj, Tj= self.Mode2Field(self.Modes[:,j])
-            ujxc, ujyc= self.Compute_d_d1(uj)      
-            vjxc, vjyc= self.Compute_d_d1(vj) 
-            Tjxc, Tjyc= self.Compute_d_d1(Tj) 
-            for k in range(self.M):
-                pk, uk,vk,Tk= self.Mode2Field(self.Modes[:,k])
-                for i in range(self.M):
-                    pi, ui,vi,Ti = self.Mode2Field(self.Modes[:,i])
-                    Aeqs[0,k,i,j] = ( self.Interior*(ui*ujxc*uk + vi*ujyc*uk) ).sum() \
-                                   +( self.Interior*(ui*vjxc*vk + vi*vjyc*vk) ).sum() \
-                                   +( self.Interior*(ui*Tjxc*Tk + vi*Tjyc*Tk) ).sum()
-                    Abc[0,k,i]    = ( self.Interior*(ui*TBCxc*Tk + vi*TBCyc*Tk) ).sum()
+        # stack all mode fields and their derivatives once: (M, Nx, Ny)
+        fields = [self.Mode2Field(self.Modes[:,j]) for j in range(self.M)]
+        U = np.stack([f[1] for f in fields])
+        V = np.stack([f[2] for f in fields])
+        T = np.stack([f[3] for f in fields])
+        Uxc, Uyc = np.matmul(self.dx, U)/self.xCoef, np.matmul(U, self.dyT)/self.yCoef
+        Vxc, Vyc = np.matmul(self.dx, V)/self.xCoef, np.matmul(V, self.dyT)/self.yCoef
+        Txc, Tyc = np.matmul(self.dx, T)/self.xCoef, np.matmul(T, self.dyT)/self.yCoef
+        UI, VI = U*self.Interior, V*self.Interior
+        # contract the triple products over the grid in one shot
+        Aeqs[0] = np.einsum('ixy,jxy,kxy->kij', UI, Uxc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', VI, Uyc, U, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', UI, Vxc, V, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', VI, Vyc, V, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', UI, Txc, T, optimize=True)\
+                 +np.einsum('ixy,jxy,kxy->kij', VI, Tyc, T, optimize=True)
+        Abc[0]  = np.einsum('ixy,xy,kxy->ki', UI, TBCxc, T, optimize=True)\
+                 +np.einsum('ixy,xy,kxy->ki', VI, TBCyc, T, optimize=True)
         return Aeqs,Abc
         
     def getB(self):
@@ -198,11 +224,9 @@ class CustomedEqs():
                 Beqs[4,i,j] = ( self.Interior*(  ujxc*pi  +  vjyc*pi ) ).sum()\
                              +( self.Interior*(  pjxc*ui  +  pjyc*vi ) ).sum()
 
-                Bbc[0,i] = 0
+                # only the diffusion row sees the temperature BC; the other
+                # rows of Bbc stay at their zero initialization
                 Bbc[1,i] =-( self.Interior*(  TBCxc2*Ti + TBCyc2*Ti ) ).sum()
-                Bbc[2,i] = 0
-                Bbc[3,i] = 0
-                Bbc[4,i] = 0              
         return Beqs,Bbc
     
     def getABCoef(self, alpha, cos=np.cos, sin=np.sin, sqrt=np.sqrt, cat=np.concatenate ):
@@ -238,7 +262,7 @@ class CustomedEqs():
             if lamda_init is None:
                 dis = (alphai - self.parameters)/ (self.design_space[1:2,:]-self.design_space[0:1,:] )
                 dis = np.linalg.norm(dis, axis=1);
-                ind = np.where(dis == dis.min())[0][0]
+                ind = np.argmin(dis)
                 lamda0 = self.projections[0:self.M, ind:ind+1].T
             else:
                 lamda0 = lamda_init[i:i+1,:]   
@@ -259,10 +283,10 @@ class CustomedEqs():
             raise Exception('The number of lamda should be equal to validation parameters')
         phi_pred         = np.matmul( lamda, self.Modes.T)
         phi_Num          = self.ValidationSamples.T
-        Error = np.zeros((Nvalidation,NVAR))    # the second dimension is [p,u,v]
-        for nvar in range(NVAR):
-            Error[:,nvar] = np.linalg.norm(phi_Num[:,nvar::NVAR]-phi_pred[:,nvar::NVAR], axis = 1)\
-                           /np.linalg.norm(phi_Num[:,nvar::NVAR], axis=1)
+        # snapshots are point-major with the variables on the innermost
+        # axis, so one reshape separates [p,u,v,T] for all cases at once
+        Error = np.linalg.norm((phi_Num-phi_pred).reshape(Nvalidation,-1,NVAR), axis=1)\
+               /np.linalg.norm(  phi_Num          .reshape(Nvalidation,-1,NVAR), axis=1)
         ErrorpuvT = Error.mean(axis=0)
         Errortotal =  np.linalg.norm(phi_Num[:,:]-phi_pred[:,:], axis = 1)\
                                    /np.linalg.norm(phi_Num[:,:], axis=1)
@@ -291,23 +315,11 @@ class CustomedEqs():
             _, ui_yc= self.Compute_d_d1(ui)
             vi_xc, _= self.Compute_d_d1(vi)
             xp,yp,xc,yc = self.getGrid(alphai)
-            hx = abs(xc[0,0]-xc[1,0])*self.xCoef
-            hy = abs(yc[0,0]-yc[0,1])*self.yCoef
             omegai =  ui_yc -vi_xc
-            ## solve psi with explicit method
+            ## solve psi with a direct method
             # psi_xp2 + psi_yp2 = omega
-            dt = 0.5*min(hx,hy)**2
-            psii = 0*omegai
-            for it in range(int(1E8)):
-                psi_xc2,psi_yc2 = self.Compute_d_d2(psii) 
-                dpsi = psi_xc2+psi_yc2-omegai
-                dpsi = dpsi * self.Interior
-                psii = psii +dpsi*dt
-                if it%10000==0:
-                    print('%8d, dpsi=%e'%(it, np.abs(dpsi).max()))
-                if np.abs(dpsi).max() < 1E-8:
-                    break
-            
+            psii = self.SolvePsiPoisson(omegai)
+
             # write result
             Nx,Ny = self.FieldShape
             with open(filename+'%d'%icase+'.plt','w') as f: